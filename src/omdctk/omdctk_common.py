@@ -166,8 +166,8 @@ def show_advise_legend(color_treatment):
               rich_text_colored('[Acceptable]', 'acceptable', color_treatment) + ' You should be able to continue without much trouble.', '',
               rich_text_colored(' [Dangerous]', 'dangerous', color_treatment) + ' You must be extremely careful. There could be major problems.', '', 
               rich_text_colored('   [Warning]', 'legend_warning', color_treatment) + ' You should be able to continue with some effort,\n             but it could get complicated or even dangerous. Be extra careful. ')
-    #Print legend
-    for i in legend: print(i)
+    #Print legend (all lines at once)
+    print('\n'.join(legend))
 
 
 def check_existence_directory_parameter(dir_path, dir_type, parameter):
@@ -222,8 +222,8 @@ def treat_duplicated_outfiles(directory, file_extension, file_name):
         Else it will return a new_file_name.
 
     """
-    #Get files in directory
-    files = os.listdir(directory)
+    #Get files in directory (as a set, for the membership checks)
+    files = set(os.listdir(directory))
     #Get copy for file name
     new_file_name = file_name
     #IF/ELSE
@@ -241,7 +241,7 @@ def treat_duplicated_outfiles(directory, file_extension, file_name):
         return file_name
        
 
-def treat_output_directory_parameter_outfiles(file_name, outputdir_path):
+def treat_output_directory_parameter_outfiles(file_name, outputdir_path, file_extension = '.tsv'):
      """
      This function will treat the output_directory parameter and return
      the full path for the output file_name provided.
@@ -252,6 +252,8 @@ def treat_output_directory_parameter_outfiles(file_name, outputdir_path):
          Name for the output file.
      outputdir_path : str
          Output directory path.
+     file_extension : str, optional
+         Extension of the output file. The default is '.tsv'.
 
      Returns
      -------
@@ -263,13 +265,13 @@ def treat_output_directory_parameter_outfiles(file_name, outputdir_path):
      if outputdir_path is None:
          #Check if file_name exits in current directory
          #If exits get new name
-         out_name = treat_duplicated_outfiles(os.getcwd(), '.tsv', file_name)
+         out_name = treat_duplicated_outfiles(os.getcwd(), file_extension, file_name)
          #Get final full path
          outputfile_path = os.path.join(os.getcwd(), out_name)
      else:
          #Check if file_name exits in provided output directory
          #If exits get new name
-         out_name = treat_duplicated_outfiles(outputdir_path, '.tsv', file_name)
+         out_name = treat_duplicated_outfiles(outputdir_path, file_extension, file_name)
          #Get final full path
          outputfile_path = os.path.join(outputdir_path, out_name)
      return outputfile_path
@@ -424,13 +426,10 @@ def print_list_n_byline(list_to_print, n_elements):
     """
     #Generate sublist of n_elements len
     splited_list = [list_to_print[i:i+n_elements] for i in range(0,len(list_to_print),n_elements)]
-    #Iter list of list / Each list will be a line
-    for i in splited_list:
-        #Format depending on if it is the last line
-        if i == splited_list[-1]:
-            print(*i, sep = ', ', end = '\n')
-        else:
-            print(*i, sep = ', ', end = ',\n')
+    #Each list will be a line (all lines are written at once)
+    if len(splited_list) > 0:
+        lines = [', '.join(map(str, i)) for i in splited_list]
+        print(',\n'.join(lines))
 
 
 def get_urls_from_ENA_column(metadata_df, column):
@@ -782,17 +781,17 @@ def check_duplicates_in_fastq_names(treatment_df, n_elements):
         raise OMD_CTK_Exception(' '.join(frase))
 
 
-def check_fastq_name_type(fastq_file_name, fastq_type, fastq_pattern, R1_pattern, R2_pattern):
+def check_fastq_names_types(fastq_file_names, fastq_types, fastq_pattern, R1_pattern, R2_pattern):
     """
-    This function checks if a fastq_file_name ends with the expected pattern
-    for its fastq_type. It processes only one input at a time. 
+    This function checks if each fastq_file_name ends with the expected pattern
+    for its fastq_type, processing all inputs at once.
 
     Parameters
     ----------
-    fastq_file_name : str
-        The fastq file to check.
-    fastq_type : str
-        The fastq type assigned to the fastq file.
+    fastq_file_names : pandas series
+        The fastq files to check.
+    fastq_types : pandas series
+        The fastq types assigned to the fastq files.
     fastq_pattern : str
         The Fastq File Pattern provided.
     R1_pattern : str
@@ -802,26 +801,26 @@ def check_fastq_name_type(fastq_file_name, fastq_type, fastq_pattern, R1_pattern
 
     Returns
     -------
-    bool_value : bool
+    bool_values : pandas series
         True: file name and patterns match.
         False: file name and patterns do not match.
     
     """
-    if fastq_type == 'pair1' and fastq_file_name.endswith(R1_pattern):
-        bool_value = True
-    elif fastq_type == 'pair2' and fastq_file_name.endswith(R2_pattern):
-        bool_value = True
-    elif fastq_type == 'single' and fastq_file_name.endswith(fastq_pattern) and not (fastq_file_name.endswith(R1_pattern) or fastq_file_name.endswith(R2_pattern)):
-        bool_value = True
-    else:
-        bool_value = False
+    #Get pattern matches (the patterns are checked only once for all files)
+    ends_r1 = fastq_file_names.str.endswith(R1_pattern)
+    ends_r2 = fastq_file_names.str.endswith(R2_pattern)
+    ends_fastq = fastq_file_names.str.endswith(fastq_pattern)
+    ##Check matches depending on fastq_type
+    bool_values = (((fastq_types == 'pair1') & ends_r1) | 
+                   ((fastq_types == 'pair2') & ends_r2) | 
+                   ((fastq_types == 'single') & ends_fastq & ~(ends_r1 | ends_r2)))
     ##Return results
-    return bool_value
+    return bool_values
 
 
 def treat_check_fastq_name_type(treatment_df, fastq_pattern, R1_pattern, R2_pattern, n_elements):
     """
-    This function treats the check_fastq_name_type results per file.
+    This function treats the check_fastq_names_types results per file.
 
     Parameters
     ----------
@@ -847,19 +846,9 @@ def treat_check_fastq_name_type(treatment_df, fastq_pattern, R1_pattern, R2_patt
     None.
 
     """
-    #Init warning files list
-    warnings_list = []
-    
-    #Check each file
-    for i,r in treatment_df.iterrows():
-        #Get temp values
-        temp_file_name = r['fastq_file_name']
-        #Get temp type
-        temp_type = r['fastq_type']
-        #Get temp check
-        temp_check = check_fastq_name_type(temp_file_name, temp_type, fastq_pattern, R1_pattern, R2_pattern)
-        if temp_check == False:
-            warnings_list.append(temp_file_name)
+    #Check all files at once and get warning files list
+    checks = check_fastq_names_types(treatment_df['fastq_file_name'], treatment_df['fastq_type'], fastq_pattern, R1_pattern, R2_pattern)
+    warnings_list = list(treatment_df['fastq_file_name'][~checks])
     
     #If warnings_list is not empty raise exception
     if len(warnings_list) > 0:
@@ -905,18 +894,11 @@ def check_treatment_for_samples(treatment_df, unique_samples_list, n_elements):
     None.
     
     """
-    #Init results list
-    warnings_list = []
-    
-    #Iter by sample
-    for sample in unique_samples_list:
-        #Filter table by sample
-        temp_sample = treatment_df[treatment_df['sample_name'] == sample]
-        #Unique treatments with set
-        temp_set_treatment = set(temp_sample['treatment'])
-        #Check unique values len for treatment
-        if len(temp_set_treatment)!=1:
-            warnings_list.append(sample)
+    #Get number of unique treatments for all samples at once (keeping unique_samples_list order)
+    n_treatments = (treatment_df.groupby('sample_name', observed = True)['treatment'].nunique(dropna = False)
+                    .reindex(unique_samples_list, fill_value = 0))
+    #Check unique values len for treatment
+    warnings_list = n_treatments.index[n_treatments.to_numpy() != 1].astype(str).tolist()
     
     #If warnings_list is not empty raise exception
     if len(warnings_list) > 0:
@@ -938,6 +920,60 @@ def check_treatment_for_samples(treatment_df, unique_samples_list, n_elements):
         raise OMD_CTK_Exception(' '.join(frase))
 
 
+def count_fastq_types_by_sample(treatment_df, unique_samples_list):
+    """
+    This function counts the number of fastq files of each fastq type 
+    (VALID_FASTQ_TYPES) for each sample.
+
+    Parameters
+    ----------
+    treatment_df : pandas dataframe
+        The provided treatment dataframe.
+    unique_samples_list : list
+        List of unique sample_names in Treatment Template.
+
+    Returns
+    -------
+    counts_df : pandas dataframe
+        Number of fastq files per sample (rows, in unique_samples_list order)
+        and fastq type (columns).
+
+    """
+    counts_df = (treatment_df.groupby(['sample_name', 'fastq_type'], observed = True).size().unstack(fill_value = 0)
+                 .reindex(index = unique_samples_list, columns = VALID_FASTQ_TYPES, fill_value = 0))
+    return counts_df
+
+
+def get_fastq_types_configurations_frases(counts_df, color_treatment):
+    """
+    This function creates the exception frases of the samples with 
+    incompatible fastq files configurations.
+
+    Parameters
+    ----------
+    counts_df : pandas dataframe
+        Number of fastq files per fastq type of the incompatible samples 
+        (from count_fastq_types_by_sample()).
+    color_treatment: bool
+        The color treatment option provided.
+        True : Plain Text
+        False : Colored Text
+
+    Returns
+    -------
+    check_frases : list
+        The exception frase of each sample.
+
+    """
+    #Set colored strs once
+    sample_str = '\n- ' + rich_text_colored('Sample Name: ', 'check_color', color_treatment)
+    configuration_str = rich_text_colored('\n  Configuration: ', 'general_text', color_treatment)
+    #Create frases
+    check_frases = [''.join([sample_str, str(sample), configuration_str, 'Number of pair1(s) = ', str(n_pair1), '; Number of pair2(s) = ', str(n_pair2), '; Number of single(s) = ', str(n_single)])
+                    for sample, n_pair1, n_pair2, n_single in zip(counts_df.index, *(counts_df[col] for col in VALID_FASTQ_TYPES))]
+    return check_frases
+
+
 def check_rename_samples(treatment_df, unique_samples_list, color_treatment):
     """
     This function checks if the fastq files configurations are
@@ -966,39 +1002,21 @@ def check_rename_samples(treatment_df, unique_samples_list, color_treatment):
     None.
     
     """
-    #Init results list
-    check_frases = []
+    #Get number of fastq types for all samples at once
+    counts_df = count_fastq_types_by_sample(treatment_df, unique_samples_list)
+    n_pair1, n_pair2, n_single = (counts_df[col].to_numpy() for col in VALID_FASTQ_TYPES)
+    #Treat only rename treatment samples
+    is_rename = treatment_df['treatment'].eq('rename').groupby(treatment_df['sample_name'], observed = True).any().reindex(unique_samples_list, fill_value = False).to_numpy()
     
-    #Iter by sample
-    for sample in unique_samples_list:
-        #Filter table by sample
-        temp_sample = treatment_df[treatment_df['sample_name'] == sample]
-        #Unique treatments with set
-        temp_set_treatment = set(temp_sample['treatment'])
-        #List of fastq_types
-        temp_list_fastqtypes = list(temp_sample['fastq_type'])
-        #Get temp number of types
-        temp_n_pair1 = temp_list_fastqtypes.count('pair1')
-        temp_n_pair2 = temp_list_fastqtypes.count('pair2')
-        temp_n_single = temp_list_fastqtypes.count('single')
-        #Treat only rename treatment samples
-        if 'rename' not in temp_set_treatment:
-            pass
-        else:
-            #Paired files with orphan single fastq file
-            if temp_n_pair1 == 1 and temp_n_pair2 == 1 and temp_n_single == 1:
-                pass
-            #A unique single fastq file
-            elif temp_n_pair1==0 and temp_n_pair2==0 and temp_n_single==1:
-                pass
-            #A pair of PAIRED fastq files
-            elif temp_n_pair1==1 and temp_n_pair2==1 and temp_n_single==0:
-                pass
-            #Anything else is not an acceptable rename configuration
-            else:
-                print_strn = '\n- ' + rich_text_colored('Sample Name: ', 'check_color', color_treatment) + sample
-                print_strn = print_strn + rich_text_colored('\n  Configuration: ', 'general_text', color_treatment) + ''.join(['Number of pair1(s) = ', str(temp_n_pair1), '; Number of pair2(s) = ', str(temp_n_pair2), '; Number of single(s) = ', str(temp_n_single)])
-                check_frases.append(print_strn)
+    #Check configurations
+    ##Paired files with orphan single fastq file
+    ##A unique single fastq file
+    ##A pair of PAIRED fastq files
+    is_permitted = (((n_pair1 == 1) & (n_pair2 == 1) & (n_single == 1)) |
+                    ((n_pair1 == 0) & (n_pair2 == 0) & (n_single == 1)) |
+                    ((n_pair1 == 1) & (n_pair2 == 1) & (n_single == 0)))
+    ##Anything else is not an acceptable rename configuration
+    check_frases = get_fastq_types_configurations_frases(counts_df[is_rename & ~is_permitted], color_treatment)
     
     #If check_frases is not empty raise exception
     if len(check_frases) > 0:
@@ -1043,39 +1061,21 @@ def check_merge_samples(treatment_df, unique_samples_list, color_treatment):
     None.
     
     """
-    #Init results list
-    check_frases = []
+    #Get number of fastq types for all samples at once
+    counts_df = count_fastq_types_by_sample(treatment_df, unique_samples_list)
+    n_pair1, n_pair2, n_single = (counts_df[col].to_numpy() for col in VALID_FASTQ_TYPES)
+    #Treat only merge treatment samples
+    is_merge = treatment_df['treatment'].eq('merge').groupby(treatment_df['sample_name'], observed = True).any().reindex(unique_samples_list, fill_value = False).to_numpy()
     
-    #Iter by sample
-    for sample in unique_samples_list:
-        #Filter table by sample
-        temp_sample = treatment_df[treatment_df['sample_name'] == sample]
-        #Unique treatments with set
-        temp_set_treatment = set(temp_sample['treatment'])
-        #List of fastq_types
-        temp_list_fastqtypes = list(temp_sample['fastq_type'])
-        #Get temp number of types
-        temp_n_pair1 = temp_list_fastqtypes.count('pair1')
-        temp_n_pair2 = temp_list_fastqtypes.count('pair2')
-        temp_n_single = temp_list_fastqtypes.count('single')
-        #Treat only merge treatment samples
-        if 'merge' not in temp_set_treatment:
-            pass
-        else:
-            #Paired files with orphan single fastq files with the same number of files and more that one fast each
-            if temp_n_pair1 > 1 and temp_n_pair2 > 1 and temp_n_single > 1 and temp_n_pair1 == temp_n_pair2 and temp_n_pair1 == temp_n_single:
-                pass
-            #More than one single fastq file but no pair1 and no pair2 files
-            elif temp_n_pair1 == 0 and temp_n_pair2 == 0 and temp_n_single > 1:
-                pass
-            #More than one fastq file for pair1 and pair2 with the same number of files, no single files 
-            elif temp_n_single == 0 and temp_n_pair1 > 1 and temp_n_pair2 > 1 and temp_n_pair1 == temp_n_pair2:
-                pass
-            #Anything else is not an acceptable merge configuration
-            else:
-                print_strn = '\n- ' + rich_text_colored('Sample Name: ', 'check_color', color_treatment) + sample
-                print_strn = print_strn + rich_text_colored('\n  Configuration: ', 'general_text', color_treatment) + ''.join(['Number of pair1(s) = ', str(temp_n_pair1), '; Number of pair2(s) = ', str(temp_n_pair2), '; Number of single(s) = ', str(temp_n_single)])
-                check_frases.append(print_strn)
+    #Check configurations
+    ##Paired files with orphan single fastq files with the same number of files and more that one fast each
+    ##More than one single fastq file but no pair1 and no pair2 files
+    ##More than one fastq file for pair1 and pair2 with the same number of files, no single files 
+    is_permitted = (((n_pair1 > 1) & (n_pair2 > 1) & (n_single > 1) & (n_pair1 == n_pair2) & (n_pair1 == n_single)) |
+                    ((n_pair1 == 0) & (n_pair2 == 0) & (n_single > 1)) |
+                    ((n_single == 0) & (n_pair1 > 1) & (n_pair2 > 1) & (n_pair1 == n_pair2)))
+    ##Anything else is not an acceptable merge configuration
+    check_frases = get_fastq_types_configurations_frases(counts_df[is_merge & ~is_permitted], color_treatment)
     
     #If check_frases is not empty raise exception
     if len(check_frases) > 0:
@@ -16,7 +16,7 @@ from omdctk import (DATE, VERSION, ENA_FASTQ_URLS_COLUMNS, TEMPLATE_FINAL_COLUMN
                     program_header, check_existence_directory_parameter, 
                     check_fastq_PAIRED_patterns, print_list_n_byline, 
                     check_headers, treat_headers_check, rich_text_colored,
-                    check_values, treat_values_check, check_na_in_pandas_dataframe,
+                    check_values, treat_values_check,
                     check_duplicates_in_fastq_names, treat_check_fastq_name_type,
                     check_treatment_for_samples, check_rename_samples, check_merge_samples,
                     treat_output_directory_parameter_outfiles, show_advise_legend,
@@ -24,8 +24,9 @@ from omdctk import (DATE, VERSION, ENA_FASTQ_URLS_COLUMNS, TEMPLATE_FINAL_COLUMN
 
 #Import third-party modules
 from argparse import ArgumentParser
-from tabulate import tabulate
+import os
 import pandas as pd
+import numpy as np
 
 #Program Constants
 GENERIC_TREATMENT_COMMON_COLUMN_CHOICES = ['sample_name', 'fastq_file_name']
@@ -41,21 +42,336 @@ ENA_COLUMNS_IGNORED = ['nominal_length', 'read_count', 'base_count',  'fastq_byt
                        'sra_md5', 'sra_ftp', 'sra_aspera', 'sra_galaxy', 'cram_index_ftp',
                        'cram_index_aspera', 'cram_index_galaxy', 'nominal_sdev', 'Read depth']
 
+METADATA_CHUNKSIZE = 100000
+
+OUTPUT_CHUNKSIZE = 100000
+
+OUTPUT_BUFFER_SIZE = 1048576
+
+CATEGORICAL_MAX_UNIQUE_RATIO = 0.5
+
+TREATMENT_CATEGORICAL_COLUMNS = ['sample_name', 'treatment', 'fastq_type']
+
+OUTPUT_FORMAT_CHOICES = ['tsv', 'parquet', 'feather']
+
 DEFAULT_TREATED_METADATA_COL_NAMES = ['final_files_sample_name', 'original_files_sample_names', 'treatment_sample_name', 'treatment_fastq_type']
 
 DEFAULT_WARNING_DF_COL_NAMES = ['final_files_sample_name', 'metadata_column_name', 'warning']
 
 WARNING_MESSAGE = 'More than one value detected after metadata combination and this metadata column was not indicated as "no warning" with the "--extra_no_warning_columns" parameter!'
 
-#Program Global Variables
-treated_metadata_df = pd.DataFrame()
-warnings_df = pd.DataFrame()
+ADVISE_TAGS = {'acceptable': '[Acceptable]', 'legend_warning': '[Warning]', 'dangerous': '[Dangerous]'}
+
+WARNING_POSSIBLE_CAUSES = [('- The presence of quality controlled Fastqs in the dataset', 'acceptable'),
+                           ('- Multiple sequencer output Fastqs (runs/lanes) from the same sample', 'legend_warning'),
+                           ('- Technical replicates from the same sample', 'legend_warning'),
+                           ('- PAIRED files uploaded as SINGLE Fastq files', 'legend_warning'),
+                           ('- The presence of different sequencing technologies', 'dangerous'),
+                           ('- The presence of different data types in the dataset', 'dangerous'),
+                           ("- Authors' mishandle, upload errors or others", 'dangerous')]
+
+WARNING_ADVICES = ['- Use the following warning report to manually confirm which is your case',
+                   '- Check if in your particular case these metadata combination merges with several values are acceptable or not',
+                   '- If necessary, search for extra information in the original database (If the dataset was not originally uploaded to ENA, try at Sequence Read Archive, or DNA Data Bank of Japan)',
+                   '- Check the original publication and supplementary tables to get some context']
 
 #Program Functions
+def load_treatment_template(treatment_file_path):
+    """
+    This function loads the provided Treatment Template file as a pandas dataframe.
+    The default pandas parser is used, as for the Metadata Table, so both tables
+    infer the same types for the same values.
+
+    Parameters
+    ----------
+    treatment_file_path : str
+        The provided Treatment Template file path.
+
+    Returns
+    -------
+    treatment_df : pandas dataframe
+        The loaded treatment dataframe.
+
+    """
+    treatment_df = pd.read_csv(treatment_file_path, sep = '\t')
+    return treatment_df
+
+
+def load_metadata_table(metadata_table_path, usecols = None):
+    """
+    This function loads the provided Metadata Table file as a pandas dataframe.
+    The file is parsed in chunks of METADATA_CHUNKSIZE rows keeping only the 
+    selected columns, which are concatenated at the end. This bounds the memory 
+    used while parsing big Metadata Tables. Text columns where the number of unique
+    values is at most CATEGORICAL_MAX_UNIQUE_RATIO of the rows are converted to
+    categorical.
+
+    Parameters
+    ----------
+    metadata_table_path : str
+        The provided Metadata Table file path.
+    usecols : callable, optional
+        Function that returns True for the column names to keep. 
+        The default is None (keep all columns).
+
+    Returns
+    -------
+    metadata_df : pandas dataframe
+        The loaded metadata dataframe.
+
+    """
+    metadata_chunks = pd.read_csv(metadata_table_path, sep = '\t', usecols = usecols, chunksize = METADATA_CHUNKSIZE)
+    metadata_df = pd.concat(metadata_chunks, ignore_index = True)
+    
+    #Store text columns with repeated values as categorical
+    for col in metadata_df.select_dtypes(include = ['object', 'string']).columns:
+        if metadata_df[col].nunique() <= CATEGORICAL_MAX_UNIQUE_RATIO * len(metadata_df):
+            metadata_df[col] = metadata_df[col].astype('category')
+    
+    return metadata_df
+
+
+def save_tsv_table(table_df, outfile_path):
+    """
+    This function saves the provided dataframe as a tab separated file with 
+    header and without index.
+    The pyarrow CSV writer is used if it is available and all the columns are
+    text, otherwise the default pandas writer is used. With pyarrow, the table is
+    converted and written in chunks of OUTPUT_CHUNKSIZE rows, so a full Arrow 
+    copy of the table is never held in memory.
+    
+    NOTE: pyarrow is used without quoting, so it gives the same file as pandas.
+    Values or column names with tabs, quotes or line breaks need quoting, and 
+    make pyarrow raise an error, so these tables are saved with pandas. Single
+    column tables are also saved with pandas, as it quotes their empty values.
+    The pandas writer uses a file opened with an OUTPUT_BUFFER_SIZE buffer.
+
+    Parameters
+    ----------
+    table_df : pandas dataframe
+        The dataframe to save.
+    outfile_path : str
+        The output file path.
+
+    Returns
+    -------
+    None.
+
+    """
+    try:
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+        ##The first chunk sets the schema (only text columns are written with pyarrow)
+        table = pa.Table.from_pandas(table_df.iloc[:OUTPUT_CHUNKSIZE], preserve_index = False)
+        if table_df.shape[1] > 1 and all(pa.types.is_string(field.type) or pa.types.is_large_string(field.type) for field in table.schema):
+            write_options = pa_csv.WriteOptions(delimiter = '\t', eol = os.linesep, quoting_style = 'none', quoting_header = 'none')
+            with pa_csv.CSVWriter(outfile_path, table.schema, write_options = write_options) as writer:
+                writer.write_table(table)
+                for start in range(OUTPUT_CHUNKSIZE, len(table_df), OUTPUT_CHUNKSIZE):
+                    writer.write_table(pa.Table.from_pandas(table_df.iloc[start:start + OUTPUT_CHUNKSIZE], schema = table.schema, preserve_index = False))
+            return
+    except (ImportError, TypeError, ValueError):
+        pass
+    with open(outfile_path, 'w', buffering = OUTPUT_BUFFER_SIZE, encoding = 'utf-8', newline = '') as outfile:
+        table_df.to_csv(outfile, header = True, index = False, sep = '\t')
+
+
+def show_treatment_warnings_message(color_treatment):
+    """
+    This function sets and prints the message shown when some samples showed 
+    warnings during the metadata treatment (WARNING_POSSIBLE_CAUSES with their 
+    ADVISE_TAGS, and WARNING_ADVICES).
+
+    Parameters
+    ----------
+    color_treatment: bool
+        The color treatment option provided.
+        True : Plain Text
+        False : Colored Text
+
+    Returns
+    -------
+    None.
+
+    """
+    #Set colored advise tags once (ADVISE_TAGS)
+    colored_tags = {category: rich_text_colored(tag, category, color_treatment) for category, tag in ADVISE_TAGS.items()}
+    #Set message strs
+    message = [rich_text_colored('\nSome of the samples showed warnings when trying to treat their metadata!', 'program_warning', color_treatment),
+               rich_text_colored('\nThis could be due to:','due_to_header', color_treatment)]
+    message.extend(cause + ' ' + colored_tags[category] for cause, category in WARNING_POSSIBLE_CAUSES)
+    message.append(rich_text_colored('\nYou should:', 'you_should_header', color_treatment))
+    message.extend(WARNING_ADVICES)
+    #Print message (all lines at once)
+    print('\n'.join(message))
+
+
+def get_output_file_name(file_name, output_format):
+    """
+    This function gets the output file name for the provided output format.
+    TSV outputs keep the provided file name, while for the other formats
+    its extension is replaced by the output format.
+
+    Parameters
+    ----------
+    file_name : str
+        The output file name for the TSV format.
+    output_format : str
+        The output file format (OUTPUT_FORMAT_CHOICES).
+
+    Returns
+    -------
+    output_file_name : str
+        The output file name for the provided output format.
+
+    """
+    if output_format == 'tsv':
+        return file_name
+    else:
+        return os.path.splitext(file_name)[0] + '.' + output_format
+
+
+def save_table(table_df, outfile_path, output_format):
+    """
+    This function saves the provided dataframe in the provided output format.
+    
+    NOTE: The parquet (zstd compressed) and feather formats need the optional 
+    pyarrow dependency.
+
+    Parameters
+    ----------
+    table_df : pandas dataframe
+        The dataframe to save.
+    outfile_path : str
+        The output file path.
+    output_format : str
+        The output file format (OUTPUT_FORMAT_CHOICES).
+
+    Returns
+    -------
+    None.
+
+    """
+    if output_format == 'parquet':
+        table_df.to_parquet(outfile_path, compression = 'zstd', index = False)
+    elif output_format == 'feather':
+        table_df.reset_index(drop = True).to_feather(outfile_path)
+    else:
+        save_tsv_table(table_df, outfile_path)
+
+
+def save_output_table(table_df, outfile_path, output_format, file_content, color_treatment):
+    """
+    This function shows the saved file message and saves the provided dataframe
+    in the provided output format with save_table().
+
+    Parameters
+    ----------
+    table_df : pandas dataframe
+        The dataframe to save.
+    outfile_path : str
+        The output file path.
+    output_format : str
+        The output file format (OUTPUT_FORMAT_CHOICES).
+    file_content : str
+        The content of the file shown in the message (i.e. "results" or "report").
+    color_treatment: bool
+        The color treatment option provided.
+        True : Plain Text
+        False : Colored Text
+
+    Returns
+    -------
+    None.
+
+    """
+    #Show saved file message
+    print(rich_text_colored('\nSaving ' + file_content + ' in file:', 'general_text', color_treatment) + '\n' + outfile_path)
+    
+    #Save table
+    save_table(table_df, outfile_path, output_format)
+
+
+def get_treatment_template_checks(treatment_df):
+    """
+    This function computes all the column checks of the Treatment Template 
+    at once, so that they can be treated afterwards in main().
+    
+    NOTE: The remaining checks are only computed if all the needed headers 
+    are present in the Treatment Template.
+
+    Parameters
+    ----------
+    treatment_df : pandas dataframe
+        The provided treatment dataframe.
+
+    Returns
+    -------
+    checks : dict
+        Dictionary with the check results:
+            - 'headers' : True if all TEMPLATE_FINAL_COLUMNS are present.
+            - 'fastq_type' : True if all "fastq_type" values are valid.
+            - 'treatment' : True if all "treatment" values are valid.
+            - 'na_sample_name' : True if "sample_name" contains NAs.
+            - 'na_fastq_file_name' : True if "fastq_file_name" contains NAs.
+            - 'duplicated_fastq_file_name' : True if "fastq_file_name" contains duplicates.
+
+    """
+    #Check headers
+    checks = {'headers' : check_headers(TEMPLATE_FINAL_COLUMNS, treatment_df)}
+    if checks['headers'] == False:
+        return checks
+    
+    #Check values
+    checks['fastq_type'] = check_values(VALID_FASTQ_TYPES, treatment_df['fastq_type'])
+    checks['treatment'] = check_values(VALID_TREATMENTS, treatment_df['treatment'])
+    
+    #Check NAs in both name columns at once
+    na_names = treatment_df[['sample_name', 'fastq_file_name']].isna().any()
+    checks['na_sample_name'] = bool(na_names['sample_name'])
+    checks['na_fastq_file_name'] = bool(na_names['fastq_file_name'])
+    
+    #Check duplicates in Fastq names
+    checks['duplicated_fastq_file_name'] = bool(treatment_df['fastq_file_name'].duplicated().any())
+    
+    return checks
+
+
+def get_fastq_names_index(fastq_values):
+    """
+    This function gets the file names of the provided Metadata Table column values
+    (semicolon separated paths or urls) together with their row positions.
+
+    Parameters
+    ----------
+    fastq_values : pandas series
+        Metadata Table column with the fastq files (ENA Download Column
+        or Generic Common Metadata Column).
+
+    Returns
+    -------
+    names_df : pandas dataframe
+        Unique pairs of file name ("fastq_file_name" column) and row position 
+        in fastq_values ("position" column).
+
+    """
+    #Split values and keep the file name of each path/url
+    names = pd.Series(fastq_values.to_numpy()).str.split(';').explode()
+    names = names.str.rsplit('/', n = 1).str[-1]
+    
+    #Create names_df
+    names_df = pd.DataFrame({'fastq_file_name': names.to_numpy(), 'position': names.index.to_numpy()})
+    names_df = names_df.dropna().drop_duplicates(ignore_index = True)
+    
+    return names_df
+
+
 def check_treatment_fastqs_in_metadata(treatment_df, metadata_df, column, color_treatment):
     """
     This function checks if all the provided fastq file names in the Treatment Template
     are found only one time in the Metadata. Differentiates between zero and more than one match.
+    Fastq file names are matched to the file names of the metadata column values, and 
+    searched as substrings of the values only if they do not have an exact match.
 
     Parameters
     ----------
@@ -81,21 +397,18 @@ def check_treatment_fastqs_in_metadata(treatment_df, metadata_df, column, color_
     None.
 
     """
-    #Init results lists
-    fastqs_warnings_more_than_one_match = []
-    fastqs_warnings_zero_matches = []
+    #Get number of metadata rows matching each fastq file name
+    ##Count exact file name matches for all fastq files at once
+    names_df = get_fastq_names_index(metadata_df[column])
+    fastq_file_names = treatment_df['fastq_file_name']
+    n_matches = fastq_file_names.map(names_df['fastq_file_name'].value_counts()).fillna(0).astype(int)
+    ##Search fastq files without exact match as substrings (i.e. values which are not paths or urls)
+    for i in np.flatnonzero(n_matches.to_numpy() == 0):
+        n_matches.iat[i] = metadata_df[column].str.contains(fastq_file_names.iat[i]).sum()
     
-    #Iter and process fastq files info
-    for i,r in treatment_df.iterrows():
-        temp_fastq_name = r['fastq_file_name']
-        temp_fastq_df = metadata_df[metadata_df[column].str.contains(temp_fastq_name)]
-        #Treat info depending on temp_fastq_df len()/ Treat warnings/ Else pass
-        if len(temp_fastq_df) == 1:
-            pass
-        elif len(temp_fastq_df) > 1:
-            fastqs_warnings_more_than_one_match.append(temp_fastq_name)
-        else:
-            fastqs_warnings_zero_matches.append(temp_fastq_name)
+    #Get results lists
+    fastqs_warnings_more_than_one_match = fastq_file_names[n_matches > 1].tolist()
+    fastqs_warnings_zero_matches = fastq_file_names[n_matches == 0].tolist()
     
     #If there are warnings raise exception
     if len(fastqs_warnings_more_than_one_match) > 0 or len(fastqs_warnings_zero_matches) > 0:
@@ -149,15 +462,15 @@ def check_common_columns_generic_mode(common_col_tt, common_col_mt, treatment_df
         raise OMD_CTK_Exception(frase)
 
 
-def unique_original_sample_names(sample_treatment_df, fastq_pattern, sep, n_sep):
+def get_original_sample_names(fastq_file_names, fastq_pattern, sep, n_sep):
     """
-    This function generates a list with the unique original sample names from
-    the treatment template based on "fastq_file_name" column.
+    This function gets the original sample name of each of the provided
+    fastq file names (sample_name + rest + fastq_pattern).
 
     Parameters
     ----------
-    sample_treatment_df : pandas dataframe
-        The provided filted sample treatment dataframe.
+    fastq_file_names : pandas series
+        The provided fastq file names (treatment template "fastq_file_name" column).
     fastq_pattern : str
         Extension pattern to recognize a Fastq file.
     sep : str
@@ -167,30 +480,29 @@ def unique_original_sample_names(sample_treatment_df, fastq_pattern, sep, n_sep)
 
     Returns
     -------
-    unique_original_names : list
-        Unique original sample names.
+    original_names : pandas series
+        Original sample name for each fastq file.
 
     """
     #Process fastq_file_name (sample_name + rest + fastq_pattern)
-    ##Remove fastq_pattern
-    original_fastq_names_without_extension = sample_treatment_df['fastq_file_name'].str.replace(fastq_pattern, '', regex = False)
+    ##Remove fastq_pattern (ending of the file name)
+    original_fastq_names_without_extension = fastq_file_names.str.removesuffix(fastq_pattern)
     
     ##Process fastq names without extension to keep original sample_name
-    unique_original_names = list(set(original_fastq_names_without_extension.str.split(sep).apply(lambda x:x[:n_sep]).str.join(sep)))
-    unique_original_names.sort()
+    original_names = original_fastq_names_without_extension.str.split(sep, n = n_sep).str[:n_sep].str.join(sep)
     
-    return unique_original_names
+    return original_names
 
 
-def get_possible_files_suffixes(sample_treatment_df, fastq_pattern, sep, n_sep):
+def get_fastq_files_suffixes(fastq_file_names, fastq_pattern, sep, n_sep):
     """
-    This function generates a list with the possible suffixes for the fastq
-    files based on the treatment template "fastq_file_name" column.
+    This function gets the file suffix (sep + rest + fastq_pattern) of each of 
+    the provided fastq file names (sample_name + rest + fastq_pattern).
 
     Parameters
     ----------
-    sample_treatment_df : pandas dataframe
-        The provided filted sample treatment dataframe.
+    fastq_file_names : pandas series
+        The provided fastq file names (treatment template "fastq_file_name" column).
     fastq_pattern : str
         Extension pattern to recognize a Fastq file.
     sep : str
@@ -200,102 +512,155 @@ def get_possible_files_suffixes(sample_treatment_df, fastq_pattern, sep, n_sep):
 
     Returns
     -------
-    unique_rest_fastq_pattern : list
-        Unique list of possible file suffixes.
+    suffixes : pandas series
+        File suffix for each fastq file.
 
     """
     #Process fastq_file_name (sample_name + rest + fastq_pattern)
-    ##Remove fastq_pattern
-    original_fastq_names_without_extension = sample_treatment_df['fastq_file_name'].str.replace(fastq_pattern, '', regex = False)
+    ##Remove fastq_pattern (ending of the file name)
+    original_fastq_names_without_extension = fastq_file_names.str.removesuffix(fastq_pattern)
     
-    ##Process fastq names without extension to keep original sample_name
-    unique_rest = list(set(original_fastq_names_without_extension.str.split(sep).apply(lambda x:x[n_sep:]).str.join(sep)))
-    unique_rest_fastq_pattern = [sep + s + fastq_pattern for s in unique_rest]
-    ##Add also the fastq_pattern as it is(sample_name+fastq_pattern cases for single files i.e. SRR454159.fastq.gz)
-    unique_rest_fastq_pattern.append(fastq_pattern)
+    ##Process fastq names without extension to keep the rest after the original sample_name
+    rest = original_fastq_names_without_extension.str.split(sep, n = n_sep).str[n_sep:].str.join(sep)
+    suffixes = sep + rest + fastq_pattern
     
-    return unique_rest_fastq_pattern
+    return suffixes
 
 
-def combine_metadata_rows(final_files_sample_name, filtered_metadata_df, interest_metadata_column, no_warnings_metadata_columns):
+def get_treated_metadata_lines(treatment_df, fastq_pattern, sep, n_sep):
     """
-    This function combines the metadata (unique values, and treat NAs to '')
-    for the provided metadata column. It also treats the associated warnings.
+    This function creates the DEFAULT_TREATED_METADATA_COL_NAMES columns of
+    the treated metadata lines for all samples in the Treatment Template.
+    Samples in copy_only_mode get one line per original sample name, and
+    samples in other treatment modes (rename_mode and merge_mode) get one line.
 
     Parameters
     ----------
-    final_files_sample_name : str
-        The provided final_files_sample_name.
-    filtered_metadata_df : pandas dataframe
-        Filtered metadata table of interest.
-    interest_metadata_column : str
-        Name of the metadata column of interest to combine.
-    no_warnings_metadata_columns : list
-        List of metadata column names that is normal/expected to have
-        multiple values. No warning metadata columns.
+    treatment_df : pandas dataframe
+        The provided treatment dataframe.
+    fastq_pattern : str
+        Extension pattern to recognize a Fastq file.
+    sep : str
+        Sample Name separator.
+    n_sep : int
+        Sample Name separator appearance.
 
     Returns
     -------
-    result : str
-        Returns the combined metadata. If multiple values are found these will
-        be separated by semicolons (;).
+    lines_df : pandas dataframe
+        Treated metadata lines (sorted by sample name) with the
+        DEFAULT_TREATED_METADATA_COL_NAMES columns.
 
     """
+    #Get original sample names for all fastq files
+    names_df = treatment_df[['sample_name', 'treatment']].copy()
+    names_df['original_sample_name'] = get_original_sample_names(treatment_df['fastq_file_name'], fastq_pattern, sep, n_sep)
+    names_df = names_df.drop_duplicates().sort_values(['sample_name', 'original_sample_name'])
     
-    #Set global variables
-    global warnings_df
+    #Get unique fastq types per sample (sorted and joined)
+    fastq_types = (treatment_df[['sample_name', 'fastq_type']].drop_duplicates()
+                   .sort_values('fastq_type').groupby('sample_name', observed = True)['fastq_type'].agg(';'.join))
     
-    #1. Get values of column as list
-    metadata_col_values = list(filtered_metadata_df[interest_metadata_column])
+    #Create lines depending on treatment
+    is_copy = names_df['treatment'] == 'copy'
+    ##copy_only_mode: one line per original sample name
+    copy_names = names_df[is_copy]
+    copy_lines = pd.DataFrame({DEFAULT_TREATED_METADATA_COL_NAMES[0]: copy_names['original_sample_name'].to_numpy(),
+                               DEFAULT_TREATED_METADATA_COL_NAMES[1]: copy_names['original_sample_name'].to_numpy(),
+                               DEFAULT_TREATED_METADATA_COL_NAMES[2]: copy_names['sample_name'].to_numpy()})
+    ##other modes: one line per sample with its original sample names combined
+    other_names = names_df[~is_copy].groupby('sample_name', observed = True)['original_sample_name'].agg(';'.join)
+    other_lines = pd.DataFrame({DEFAULT_TREATED_METADATA_COL_NAMES[0]: other_names.index.to_numpy(),
+                                DEFAULT_TREATED_METADATA_COL_NAMES[1]: other_names.to_numpy(),
+                                DEFAULT_TREATED_METADATA_COL_NAMES[2]: other_names.index.to_numpy()})
     
-    #2. Treat NAs and convert to str
-    metadata_col_values_treated = []
-    for i in metadata_col_values:
-        if pd.isna(i):
-            metadata_col_values_treated.append('')
-        else:
-            metadata_col_values_treated.append(str(i))
-    
-    #3. Get list with unique values 
-    unique_values_list = list(set(metadata_col_values_treated))
-    unique_values_list.sort()
+    #Join lines keeping sample order and add fastq types
+    lines_df = pd.concat([copy_lines, other_lines], ignore_index = True)
+    lines_df = lines_df.sort_values(DEFAULT_TREATED_METADATA_COL_NAMES[2], kind = 'stable', ignore_index = True)
+    lines_df[DEFAULT_TREATED_METADATA_COL_NAMES[3]] = lines_df[DEFAULT_TREATED_METADATA_COL_NAMES[2]].map(fastq_types)
     
-    #4. Check warning for column 
-    ##If there is more than one value and col_name not in no_warnings_metadata_columns -> write to warnings_df
-    if (len(unique_values_list) > 1) and (interest_metadata_column not in no_warnings_metadata_columns):
-        #Create new line in warnings_df 
-        ##Get final_files_sample_name / DEFAULT_WARNING_DF_COL_NAMES[0]
-        ##Get metadata_column_name / DEFAULT_WARNING_DF_COL_NAMES[1]
-        ##Get warning message /  DEFAULT_WARNING_DF_COL_NAMES[2] -> WARNING_MESSAGE
-        temp_warning = pd.DataFrame([[final_files_sample_name, interest_metadata_column, WARNING_MESSAGE]], columns = DEFAULT_WARNING_DF_COL_NAMES)
-        warnings_df = pd.concat([warnings_df, temp_warning], ignore_index = True)
-        
-    #5.Convert list to formated str and return 
-    result = ';'.join(unique_values_list)
-    return result
+    return lines_df
 
 
-def other_modes_ENA_metadata(sample_treatment_df, treatment_sample_name, metadata_df, ena_download_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep):
+def combine_metadata_groups(metadata_df, group_keys, interest_metadata_columns):
     """
-    This function creates the necessary combined metadata lines for the provided 
-    sample in other treatment modes (rename_mode and merge_mode) when usign 
-    ENA mode. Lines will be saved directy in the treated_metadata_df.
+    This function combines the metadata (unique values, and treat NAs to '')
+    of the metadata columns of interest for each group of rows at once.
 
     Parameters
     ----------
-    sample_treatment_df : pandas dataframe
-        The provided filtered sample treatment dataframe.
-    treatment_sample_name : str
-        Sample Name from the Treatment Template.
     metadata_df : pandas dataframe
-        The provided metadata dataframe.
-    ena_download_column : str
-        Provided ENA Download Column from the Metadata Table.
+        Metadata table rows to combine.
+    group_keys : pandas series
+        Group key of each row in metadata_df.
     interest_metadata_columns : list
-        List with the metadata columns of interest to treat.
-    no_warnings_metadata_columns : list
-        List of metadata column names that is normal/expected to have
-        multiple values. No warning metadata columns.
+        List with the metadata columns of interest to combine.
+
+    Returns
+    -------
+    combined_df : pandas dataframe
+        Combined metadata per group key (rows) and metadata column (columns).
+        If multiple values are found these will be separated by semicolons (;).
+    n_values_df : pandas dataframe
+        Number of unique values per group key and metadata column.
+
+    """
+    #Get group (key, column) and value codes for all metadata columns of interest
+    ##Treat NAs and convert to str (column by column, without copying the whole table)
+    key_codes, key_uniques = pd.factorize(group_keys.to_numpy(), use_na_sentinel = False)
+    n_cols = len(interest_metadata_columns)
+    values = [np.where(metadata_df[col].isna(), '', metadata_df[col].astype(str)) for col in interest_metadata_columns]
+    ##Sorted value codes (value order is the str order)
+    value_codes, value_uniques = pd.factorize(np.concatenate(values) if n_cols > 0 else np.empty(0, dtype = object), sort = True)
+    group_codes = np.tile(key_codes, n_cols).astype(np.int64) * n_cols + np.repeat(np.arange(n_cols), len(key_codes))
+    
+    #Get unique sorted values per group sorting the (group, value) code pairs once
+    ##NOTE: the codes are sorted as pairs (not packed in a single int64), so there is no overflow
+    order = np.lexsort((value_codes, group_codes))
+    sorted_groups = group_codes[order]
+    sorted_values = value_codes[order]
+    is_new_pair = np.ones(len(order), dtype = bool)
+    is_new_pair[1:] = (sorted_groups[1:] != sorted_groups[:-1]) | (sorted_values[1:] != sorted_values[:-1])
+    pair_groups = sorted_groups[is_new_pair]
+    pair_values = np.asarray(value_uniques, dtype = object)[sorted_values[is_new_pair]]
+    
+    #Combine values per group (only groups with more than one value need to be joined)
+    starts = np.flatnonzero(np.diff(pair_groups, prepend = -1))
+    n_values = np.diff(np.append(starts, len(pair_groups)))
+    combined = pair_values[starts]
+    for i in np.flatnonzero(n_values > 1):
+        combined[i] = ';'.join(pair_values[starts[i]:starts[i] + n_values[i]])
+    
+    #Create results dataframes (all group keys have all the metadata columns of interest)
+    combined_matrix = np.empty(len(key_uniques) * n_cols, dtype = object)
+    combined_matrix[pair_groups[starts]] = combined
+    n_values_matrix = np.zeros(len(key_uniques) * n_cols, dtype = int)
+    n_values_matrix[pair_groups[starts]] = n_values
+    ##NOTE: combined values are always str, so the dtype is given instead of inferred per column
+    combined_df = pd.DataFrame(combined_matrix.reshape(len(key_uniques), n_cols), index = key_uniques, columns = interest_metadata_columns, dtype = 'str')
+    n_values_df = pd.DataFrame(n_values_matrix.reshape(len(key_uniques), n_cols), index = key_uniques, columns = interest_metadata_columns)
+    
+    return combined_df, n_values_df
+
+
+def get_lines_metadata_positions(lines_df, treatment_df, match_values, fastq_pattern, sep, n_sep):
+    """
+    This function gets the Metadata Table rows associated to each of the treated
+    metadata lines, searching the line fastq file names in the provided match_values.
+    Names are matched to the file names of the values, or searched as substrings
+    of the values if any Treatment Template fastq file name is not found as an
+    exact file name. For copy_only_mode lines the possible fastq file names of the original sample
+    name are searched, and for other treatment modes (rename_mode and merge_mode) 
+    lines the fastq file names of the sample are searched.
+
+    Parameters
+    ----------
+    lines_df : pandas dataframe
+        Treated metadata lines from get_treated_metadata_lines().
+    treatment_df : pandas dataframe
+        The provided treatment dataframe.
+    match_values : pandas series
+        Metadata Table column where the fastq file names are searched.
     fastq_pattern : str
         Extension pattern to recognize a Fastq file.
     sep : str
@@ -305,140 +670,120 @@ def other_modes_ENA_metadata(sample_treatment_df, treatment_sample_name, metadat
 
     Returns
     -------
-    None.
+    line_ids : numpy array
+        Line position (in lines_df) of each matched Metadata Table row.
+    positions : numpy array
+        Position (in match_values) of each matched Metadata Table row.
 
     """
-    #Set global variables
-    global treated_metadata_df
-    
-    #Get list of unique original sample names for treatment template "fastq_file_name"
-    original_sample_names = unique_original_sample_names(sample_treatment_df, fastq_pattern, sep, n_sep)
-    
-    #0. Set result list
-    sample_metadata_line = []
+    #Get search fastq file names for each treatment sample
+    ##copy_only_mode: possible fastq file suffixes (to add to the original sample names)
+    ##Also add the fastq_pattern as it is (sample_name+fastq_pattern cases for single files i.e. SRR454159.fastq.gz)
+    ##other modes: fastq file names of the sample
+    fastq_file_names = treatment_df['fastq_file_name'].to_numpy()
+    fastq_suffixes = get_fastq_files_suffixes(treatment_df['fastq_file_name'], fastq_pattern, sep, n_sep).to_numpy()
+    treatments = treatment_df['treatment'].to_numpy()
+    sample_suffixes = {}
+    sample_fastq_names = {}
+    for sample, idx in treatment_df.groupby('sample_name', observed = True, sort = False).indices.items():
+        ##NOTE: Up to this point we have check there is only one treatment per sample
+        if treatments[idx[0]] == 'copy':
+            sample_suffixes[sample] = pd.unique(fastq_suffixes[idx]).tolist() + [fastq_pattern]
+        else:
+            sample_fastq_names[sample] = fastq_file_names[idx].tolist()
     
-    #1. Filter metadata table based in fastq file names associates to current sample (treatment template) and ena_download_column (metadata)
-    ##Get list of associated fastq files of the sample
-    sample_tt_fastq_file_names = list(sample_treatment_df['fastq_file_name'])
-    ##Filter metadata
-    sample_metadata_df = metadata_df[metadata_df[ena_download_column].str.contains('|'.join(sample_tt_fastq_file_names))]
+    ##Get search fastq file names for each line
+    lines_fastq_names = []
+    for final_name, sample in zip(lines_df[DEFAULT_TREATED_METADATA_COL_NAMES[0]], lines_df[DEFAULT_TREATED_METADATA_COL_NAMES[2]]):
+        if sample in sample_suffixes:
+            lines_fastq_names.append([final_name + s for s in sample_suffixes[sample]])
+        else:
+            lines_fastq_names.append(sample_fastq_names[sample])
     
-    #2. Get DEFAULT_TREATED_METADATA_COL_NAMES
-    ##Get final_files_sample_name / DEFAULT_TREATED_METADATA_COL_NAMES[0]
-    sample_metadata_line.append(treatment_sample_name)
-    ##Get original_files_sample_names / DEFAULT_TREATED_METADATA_COL_NAMES[1]
-    original_files_sample_names = ';'.join(original_sample_names)
-    sample_metadata_line.append(original_files_sample_names)
-    ##Get treatment_sample_name / DEFAULT_TREATED_METADATA_COL_NAMES[2]
-    sample_metadata_line.append(treatment_sample_name)
-    ##Get unique list for treatment_fastq_type / DEFAULT_TREATED_METADATA_COL_NAMES[3]
-    unique_fastq_types = list(set(sample_treatment_df['fastq_type']))
-    unique_fastq_types.sort()
-    sample_metadata_line.append(';'.join(unique_fastq_types))
+    #Get matching metadata rows for each line
+    ##If all fastq file names are file names of match_values, join the line names with their rows at once
+    names_df = get_fastq_names_index(match_values)
+    if treatment_df['fastq_file_name'].isin(names_df['fastq_file_name']).all():
+        lines_names_df = pd.DataFrame({'line': np.repeat(np.arange(len(lines_fastq_names)), [len(i) for i in lines_fastq_names]),
+                                       'fastq_file_name': [name for names in lines_fastq_names for name in names]})
+        matches_df = lines_names_df.merge(names_df, on = 'fastq_file_name').drop_duplicates(['line', 'position'])
+        return matches_df['line'].to_numpy(), matches_df['position'].to_numpy()
     
-    #3. Combine each metadata column of interest 
-    for col in interest_metadata_columns:
-        temp_combined_metadata = combine_metadata_rows(treatment_sample_name, sample_metadata_df, col, no_warnings_metadata_columns)
-        sample_metadata_line.append(temp_combined_metadata)
+    ##Else search the line names as substrings of match_values (i.e. values which are not paths or urls)
+    row_positions = pd.Series(np.arange(len(match_values)), index = match_values.index)
+    line_ids = [np.empty(0, dtype = int)]
+    positions = [np.empty(0, dtype = int)]
+    for i, names in enumerate(lines_fastq_names):
+        line_positions = row_positions[match_values.str.contains('|'.join(names))].to_numpy()
+        line_ids.append(np.full(len(line_positions), i))
+        positions.append(line_positions)
     
-    #4. Create new line in treated_metadata_df
-    new_metadata_line = pd.DataFrame([sample_metadata_line], columns = DEFAULT_TREATED_METADATA_COL_NAMES + interest_metadata_columns)
-    treated_metadata_df = pd.concat([treated_metadata_df, new_metadata_line], ignore_index = True)
+    return np.concatenate(line_ids), np.concatenate(positions)
 
 
-def other_modes_generic_metadata(sample_treatment_df, treatment_sample_name, metadata_df, mt_common_column, tt_common_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep):
+def combine_lines_metadata(lines_df, metadata_df, group_keys, line_keys, interest_metadata_columns, no_warnings_metadata_columns):
     """
-    This function creates the necessary combined metadata lines for the provided 
-    sample in other treatment modes (rename_mode and merge_mode) when usign 
-    Generic mode. Lines will be saved directy in the treated_metadata_df.
+    This function combines the metadata of each group of Metadata Table rows and
+    creates the treated metadata and warnings dataframes for the provided lines.
 
     Parameters
     ----------
-    sample_treatment_df : pandas dataframe
-        The provided filtered sample treatment dataframe.
-    treatment_sample_name : str
-        Sample Name from the Treatment Template.
+    lines_df : pandas dataframe
+        Treated metadata lines from get_treated_metadata_lines().
     metadata_df : pandas dataframe
-        The provided metadata dataframe.
-    mt_common_column : str
-        Generic Common Metadata Column.
-    tt_common_column : str
-        Generic Common Treatment Template Column.
+        Metadata table rows to combine.
+    group_keys : pandas series
+        Group key of each row in metadata_df.
+    line_keys : numpy array
+        Group key of each line in lines_df.
     interest_metadata_columns : list
         List with the metadata columns of interest to treat.
     no_warnings_metadata_columns : list
         List of metadata column names that is normal/expected to have
         multiple values. No warning metadata columns.
-    fastq_pattern : str
-        Extension pattern to recognize a Fastq file.
-    sep : str
-        Sample Name separator.
-    n_sep : int
-        Sample Name separator appearance.
 
     Returns
     -------
-    None.
+    treated_metadata_df : pandas dataframe
+        The treated metadata dataframe.
+    warnings_df : pandas dataframe
+        The warnings dataframe (DEFAULT_WARNING_DF_COL_NAMES).
 
     """
-    #Set global variables
-    global treated_metadata_df
-    
-    #Get list of unique original sample names for treatment template "fastq_file_name"
-    original_sample_names = unique_original_sample_names(sample_treatment_df, fastq_pattern, sep, n_sep)
+    #1. Combine each metadata column of interest per group
+    combined_df, n_values_df = combine_metadata_groups(metadata_df, group_keys, interest_metadata_columns)
+    ##Lines without metadata rows get empty values
+    lines_metadata_df = combined_df.reindex(line_keys).fillna('').reset_index(drop = True)
     
-    #0. Set result list
-    sample_metadata_line = []
+    #2. Create treated_metadata_df
+    treated_metadata_df = pd.concat([lines_df, lines_metadata_df], axis = 1)
     
-    #1. Filter metadata table depending on the provided tt_common_column
-    if tt_common_column == 'fastq_file_name':
-        #Get temp possible fastq names
-        sample_tt_fastq_file_names = list(sample_treatment_df['fastq_file_name'])
-        ##Filter based on possible fastq file names
-        sample_metadata_df = metadata_df[metadata_df[mt_common_column].str.contains('|'.join(sample_tt_fastq_file_names))]
-    else:
-        ##Filter metadata based on treatment_sample_name
-        sample_metadata_df = metadata_df[metadata_df[mt_common_column]==treatment_sample_name]
-    
-    #2. Get DEFAULT_TREATED_METADATA_COL_NAMES
-    ##Get final_files_sample_name / DEFAULT_TREATED_METADATA_COL_NAMES[0]
-    sample_metadata_line.append(treatment_sample_name)
-    ##Get original_files_sample_names / DEFAULT_TREATED_METADATA_COL_NAMES[1]
-    original_files_sample_names = ';'.join(original_sample_names)
-    sample_metadata_line.append(original_files_sample_names)
-    ##Get treatment_sample_name / DEFAULT_TREATED_METADATA_COL_NAMES[2]
-    sample_metadata_line.append(treatment_sample_name)
-    ##Get unique list for treatment_fastq_type / DEFAULT_TREATED_METADATA_COL_NAMES[3]
-    unique_fastq_types = list(set(sample_treatment_df['fastq_type']))
-    unique_fastq_types.sort()
-    sample_metadata_line.append(';'.join(unique_fastq_types))
-    
-    #3. Combine each metadata column of interest 
-    for col in interest_metadata_columns:
-        temp_combined_metadata = combine_metadata_rows(treatment_sample_name, sample_metadata_df, col, no_warnings_metadata_columns)
-        sample_metadata_line.append(temp_combined_metadata)
+    #3. Check warnings for lines
+    ##If there is more than one value and col_name not in no_warnings_metadata_columns -> write to warnings_df
+    warning_mask = (n_values_df.reindex(line_keys).fillna(0).to_numpy() > 1) & ~n_values_df.columns.isin(no_warnings_metadata_columns)
+    line_idx, col_idx = np.nonzero(warning_mask)
+    warnings_df = pd.DataFrame({DEFAULT_WARNING_DF_COL_NAMES[0]: lines_df[DEFAULT_TREATED_METADATA_COL_NAMES[0]].to_numpy()[line_idx],
+                                DEFAULT_WARNING_DF_COL_NAMES[1]: np.array(interest_metadata_columns, dtype = object)[col_idx],
+                                DEFAULT_WARNING_DF_COL_NAMES[2]: WARNING_MESSAGE}, dtype = 'str')
     
-    #4. Create new line in treated_metadata_df
-    new_metadata_line = pd.DataFrame([sample_metadata_line], columns = DEFAULT_TREATED_METADATA_COL_NAMES + interest_metadata_columns)
-    treated_metadata_df = pd.concat([treated_metadata_df, new_metadata_line], ignore_index = True)
+    return treated_metadata_df, warnings_df
 
 
-def copy_only_mode_ENA_metadata(sample_treatment_df, treatment_sample_name, metadata_df, ena_download_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep):
+def treat_generic_metadata_by_sample_name(treatment_df, metadata_df, mt_common_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep):
     """
-    This function creates the necessary combined metadata lines for the provided 
-    sample in the case of the copy_only_mode when usign ENA mode. Lines will be 
-    saved directy in the treated_metadata_df.
+    This function treats the provided Generic Metadata Table in Generic Mode when 
+    "sample_name" is the tt_common_column. All lines of a sample share the same
+    metadata rows, so the metadata is combined once for all samples with a single
+    join and groupby.
 
     Parameters
     ----------
-    sample_treatment_df : pandas dataframe
-        The provided filereted sample treatment dataframe.
-    treatment_sample_name : str
-        Sample Name from the Treatment Template.
+    treatment_df : pandas dataframe
+        The provided treatment dataframe.
     metadata_df : pandas dataframe
         The provided metadata dataframe.
-    ena_download_column : str
-        Provided ENA Download Column from the Metadata Table.
+    mt_common_column : str
+        Generic Common Metadata Column.
     interest_metadata_columns : list
         List with the metadata columns of interest to treat.
     no_warnings_metadata_columns : list
@@ -453,71 +798,39 @@ def copy_only_mode_ENA_metadata(sample_treatment_df, treatment_sample_name, meta
 
     Returns
     -------
-    None.
+    treated_metadata_df : pandas dataframe
+        The treated metadata dataframe.
+    warnings_df : pandas dataframe
+        The warnings dataframe (DEFAULT_WARNING_DF_COL_NAMES).
 
     """
-    #Set global variables
-    global treated_metadata_df
-    
-    #Get list of unique original sample names for treatment template "fastq_file_name"
-    original_sample_names = unique_original_sample_names(sample_treatment_df, fastq_pattern, sep, n_sep)
+    #1. Get lines (DEFAULT_TREATED_METADATA_COL_NAMES) for all samples
+    lines_df = get_treated_metadata_lines(treatment_df, fastq_pattern, sep, n_sep)
+    line_samples = lines_df[DEFAULT_TREATED_METADATA_COL_NAMES[2]].to_numpy()
     
-    #Get list with possible fastq file suffixes
-    possible_fastq_file_suffixes = get_possible_files_suffixes(sample_treatment_df, fastq_pattern, sep, n_sep)
+    #2. Join metadata with the treatment samples and combine each metadata column of interest per sample
+    sample_metadata_df = metadata_df[metadata_df[mt_common_column].isin(treatment_df['sample_name'])]
+    treated_metadata_df, warnings_df = combine_lines_metadata(lines_df, sample_metadata_df, sample_metadata_df[mt_common_column], line_samples, interest_metadata_columns, no_warnings_metadata_columns)
     
-    #Treat diferent original sample names
-    for sample in original_sample_names:
-        #0. Set result list
-        temp_sample_metadata_line = []
-        
-        #Get temp possible fastq names
-        temp_possible_fastq_names = [sample + s for s in possible_fastq_file_suffixes]
-        
-        #1. Filter metadata table based in possible fastq file names for original sample name (treatment template) and ena_download_column (metadata)
-        
-        ##Filter metadata table
-        temp_sample_metadata_df = metadata_df[metadata_df[ena_download_column].str.contains('|'.join(temp_possible_fastq_names))]
-        
-        #2. Get DEFAULT_TREATED_METADATA_COL_NAMES
-        ##Get final_files_sample_name / DEFAULT_TREATED_METADATA_COL_NAMES[0]
-        temp_sample_metadata_line.append(sample)
-        ##Get original_files_sample_names / DEFAULT_TREATED_METADATA_COL_NAMES[1]
-        temp_sample_metadata_line.append(sample)
-        ##Get treatment_sample_name / DEFAULT_TREATED_METADATA_COL_NAMES[2]
-        temp_sample_metadata_line.append(treatment_sample_name)
-        ##Get unique list for treatment_fastq_type / DEFAULT_TREATED_METADATA_COL_NAMES[3]
-        unique_fastq_types = list(set(sample_treatment_df['fastq_type']))
-        unique_fastq_types.sort()
-        temp_sample_metadata_line.append(';'.join(unique_fastq_types))
-        
-        #3. Combine each metadata column of interest 
-        for col in interest_metadata_columns:
-            temp_combined_metadata = combine_metadata_rows(sample, temp_sample_metadata_df, col, no_warnings_metadata_columns)
-            temp_sample_metadata_line.append(temp_combined_metadata)
-        
-        #4. Create new line in treated_metadata_df
-        temp_metadata_line = pd.DataFrame([temp_sample_metadata_line], columns = DEFAULT_TREATED_METADATA_COL_NAMES + interest_metadata_columns)
-        treated_metadata_df = pd.concat([treated_metadata_df, temp_metadata_line], ignore_index = True)
+    return treated_metadata_df, warnings_df
 
 
-def copy_only_mode_generic_metadata(sample_treatment_df, treatment_sample_name, metadata_df, mt_common_column, tt_common_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep):
+def treat_metadata_by_fastq_file_name(treatment_df, metadata_df, fastq_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep):
     """
-    This function creates the necessary combined metadata lines for the provided 
-    sample in the case of the copy_only_mode when usign Generic mode. Lines will 
-    be saved directy in the treated_metadata_df.
+    This function treats the provided Metadata Table searching the Metadata Table 
+    rows of each line by their fastq file names (ENA mode, and Generic mode when 
+    "fastq_file_name" is the tt_common_column). The metadata is combined once for 
+    all lines with a single groupby.
 
     Parameters
     ----------
-    sample_treatment_df : pandas dataframe
-        The provided filereted sample treatment dataframe.
-    treatment_sample_name : str
-        Sample Name from the Treatment Template.
+    treatment_df : pandas dataframe
+        The provided treatment dataframe.
     metadata_df : pandas dataframe
         The provided metadata dataframe.
-    mt_common_column : str
-        Generic Common Metadata Column.
-    tt_common_column : str
-        Generic Common Treatment Template Column.
+    fastq_column : str
+        Metadata Table column with the fastq file names (ENA Download Column
+        or Generic Common Metadata Column).
     interest_metadata_columns : list
         List with the metadata columns of interest to treat.
     no_warnings_metadata_columns : list
@@ -532,56 +845,23 @@ def copy_only_mode_generic_metadata(sample_treatment_df, treatment_sample_name,
 
     Returns
     -------
-    None.
+    treated_metadata_df : pandas dataframe
+        The treated metadata dataframe.
+    warnings_df : pandas dataframe
+        The warnings dataframe (DEFAULT_WARNING_DF_COL_NAMES).
 
     """
-    #Set global variables
-    global treated_metadata_df
-    
-    #Get list of unique original sample names for treatment template "fastq_file_name"
-    original_sample_names = unique_original_sample_names(sample_treatment_df, fastq_pattern, sep, n_sep)
+    #1. Get lines (DEFAULT_TREATED_METADATA_COL_NAMES) for all samples
+    lines_df = get_treated_metadata_lines(treatment_df, fastq_pattern, sep, n_sep)
     
-    #Get list with possible fastq file suffixes
-    possible_fastq_file_suffixes = get_possible_files_suffixes(sample_treatment_df, fastq_pattern, sep, n_sep)
+    #2. Get metadata rows of each line and combine each metadata column of interest per line
+    line_ids, positions = get_lines_metadata_positions(lines_df, treatment_df, metadata_df[fastq_column], fastq_pattern, sep, n_sep)
+    treated_metadata_df, warnings_df = combine_lines_metadata(lines_df, metadata_df.take(positions), pd.Series(line_ids), np.arange(len(lines_df)), interest_metadata_columns, no_warnings_metadata_columns)
     
-    #Treat diferent original sample names
-    for sample in original_sample_names:
-        #0. Set result list
-        temp_sample_metadata_line = []
-        
-        #1. Filter metadata table depending on the provided tt_common_column
-        if tt_common_column == 'fastq_file_name':
-            #Get temp possible fastq names
-            temp_possible_fastq_names = [sample + s for s in possible_fastq_file_suffixes]
-            ##Filter based on possible fastq file names
-            temp_sample_metadata_df = metadata_df[metadata_df[mt_common_column].str.contains('|'.join(temp_possible_fastq_names))]
-        else:
-            ##Filter metadata based on treatment_sample_name
-            temp_sample_metadata_df = metadata_df[metadata_df[mt_common_column]==treatment_sample_name]
-        
-        #2. Get DEFAULT_TREATED_METADATA_COL_NAMES
-        ##Get final_files_sample_name / DEFAULT_TREATED_METADATA_COL_NAMES[0]
-        temp_sample_metadata_line.append(sample)
-        ##Get original_files_sample_names / DEFAULT_TREATED_METADATA_COL_NAMES[1]
-        temp_sample_metadata_line.append(sample)
-        ##Get treatment_sample_name / DEFAULT_TREATED_METADATA_COL_NAMES[2]
-        temp_sample_metadata_line.append(treatment_sample_name)
-        ##Get unique list for treatment_fastq_type / DEFAULT_TREATED_METADATA_COL_NAMES[3]
-        unique_fastq_types = list(set(sample_treatment_df['fastq_type']))
-        unique_fastq_types.sort()
-        temp_sample_metadata_line.append(';'.join(unique_fastq_types))
-        
-        #3. Combine each metadata column of interest 
-        for col in interest_metadata_columns:
-            temp_combined_metadata = combine_metadata_rows(sample, temp_sample_metadata_df, col, no_warnings_metadata_columns)
-            temp_sample_metadata_line.append(temp_combined_metadata)
-        
-        #4. Create new line in treated_metadata_df
-        temp_metadata_line = pd.DataFrame([temp_sample_metadata_line], columns = DEFAULT_TREATED_METADATA_COL_NAMES + interest_metadata_columns)
-        treated_metadata_df = pd.concat([treated_metadata_df, temp_metadata_line], ignore_index = True)
+    return treated_metadata_df, warnings_df
 
 
-def treat_ENA_metadata(treatment_df, unique_samples_list, metadata_df, ena_download_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep):
+def treat_ENA_metadata(treatment_df, metadata_df, ena_download_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep):
     """
     This function treats the provided ENA Metadata Table in ENA Mode based on the Treatment Template.
 
@@ -589,8 +869,6 @@ def treat_ENA_metadata(treatment_df, unique_samples_list, metadata_df, ena_downl
     ----------
     treatment_df : pandas dataframe
         The provided treatment dataframe.
-    unique_samples_list : list
-        List of unique sample_names in Treatment Template.
     metadata_df : pandas dataframe
         The provided metadata dataframe.
     ena_download_column : str
@@ -609,30 +887,17 @@ def treat_ENA_metadata(treatment_df, unique_samples_list, metadata_df, ena_downl
 
     Returns
     -------
-    None.
+    treated_metadata_df : pandas dataframe
+        The treated metadata dataframe.
+    warnings_df : pandas dataframe
+        The warnings dataframe (DEFAULT_WARNING_DF_COL_NAMES).
 
     """
-    #Set global variables
-    global treated_metadata_df
-    global warnings_df
-    
-    ##Treat metadata per sample
-    for sample in unique_samples_list:
-        #Filter table by sample
-        temp_sample = treatment_df[treatment_df['sample_name'] == sample]
-        
-        #Get treatment(get unique with set function)
-        ##NOTE: Up to this point we have check there is only one treatment per sample
-        temp_treatment = list(temp_sample['treatment'])[0]
-        
-        #Treat metadata depending on mode used for treating fastqs
-        if temp_treatment == 'copy':
-            copy_only_mode_ENA_metadata(temp_sample, sample, metadata_df, ena_download_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep)
-        else:
-            other_modes_ENA_metadata(temp_sample, sample, metadata_df, ena_download_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep)
-    
+    #Treat metadata for all samples at once searching fastq file names in ena_download_column
+    return treat_metadata_by_fastq_file_name(treatment_df, metadata_df, ena_download_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep)
 
-def treat_generic_metadata(treatment_df, unique_samples_list, metadata_df, mt_common_column, tt_common_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep):
+
+def treat_generic_metadata(treatment_df, metadata_df, mt_common_column, tt_common_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep):
     """
     This function treats the provided Generic Metadata Table in Generic Mode based on the Treatment Template
     and the provided tt_common_column.
@@ -641,8 +906,6 @@ def treat_generic_metadata(treatment_df, unique_samples_list, metadata_df, mt_co
     ----------
     treatment_df : pandas dataframe
         The provided treatment dataframe.
-    unique_samples_list : list
-        List of unique sample_names in Treatment Template.
     metadata_df : pandas dataframe
         The provided metadata dataframe.
     mt_common_column : str
@@ -663,27 +926,17 @@ def treat_generic_metadata(treatment_df, unique_samples_list, metadata_df, mt_co
 
     Returns
     -------
-    None.
+    treated_metadata_df : pandas dataframe
+        The treated metadata dataframe.
+    warnings_df : pandas dataframe
+        The warnings dataframe (DEFAULT_WARNING_DF_COL_NAMES).
 
     """
-    #Set global variables
-    global treated_metadata_df
-    global warnings_df
-    
-    ##Treat metadata per sample
-    for sample in unique_samples_list:
-        #Filter table by sample
-        temp_sample = treatment_df[treatment_df['sample_name'] == sample]
-        
-        #Get treatment(get unique with set function)
-        ##NOTE: Up to this point we have check there is only one treatment per sample
-        temp_treatment = list(temp_sample['treatment'])[0]
-        
-        #Treat metadata depending on mode used for treating fastqs
-        if temp_treatment == 'copy':
-            copy_only_mode_generic_metadata(temp_sample, sample, metadata_df, mt_common_column, tt_common_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep)
-        else:
-            other_modes_generic_metadata(temp_sample, sample, metadata_df, mt_common_column, tt_common_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep)
+    #Treat metadata for all samples at once depending on the provided tt_common_column
+    if tt_common_column == 'sample_name':
+        return treat_generic_metadata_by_sample_name(treatment_df, metadata_df, mt_common_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep)
+    else:
+        return treat_metadata_by_fastq_file_name(treatment_df, metadata_df, mt_common_column, interest_metadata_columns, no_warnings_metadata_columns, fastq_pattern, sep, n_sep)
 
     
 #Main Program
@@ -787,6 +1040,15 @@ def main():
             required = False,
             help = 'R2 File Pattern (Optional) [Default:"_2.fastq.gz"]. Indicate the pattern to identify R2 PAIRED Fastq files.'
     )
+    ##Parameter output_format
+    parser.add_argument(
+            '-f','--output_format', 
+            action = 'store',
+            choices = OUTPUT_FORMAT_CHOICES,
+            required = False,
+            default = 'tsv',
+            help = 'Output Format (Optional) [Default:tsv]. Indicate the format of the output files. The parquet and feather formats need the pyarrow package.'
+    )
     ##Parameter output_directory
     parser.add_argument(
             '-o','--output_directory', 
@@ -817,6 +1079,7 @@ def main():
     generic_common_col_mt = args.generic_common_column_mt
     generic_common_col_tt = args.generic_common_column_tt
     extra_no_warning_cols = args.extra_no_warning_columns
+    output_format = args.output_format
     outputdir_path = args.output_directory
     sample_name_separator = args.sample_name_sep
     sep_appearance = args.sample_name_sep_appearance
@@ -837,6 +1100,8 @@ def main():
     print('')
     
     #Show Program parameters
+    ##Import tabulate here, so --help and --version calls do not load it
+    from tabulate import tabulate
     print(rich_text_colored('Program Parameters:', 'section_header', plain_text_bool))
     print(tabulate(vars(args).items(), headers = ['Argument', 'Value'], tablefmt = 'simple_outline'))
     
@@ -844,24 +1109,16 @@ def main():
     try:
         #0)Initial steps and checks
         
-        #Set global variables(common to both modes)
-        global treated_metadata_df
-        global warnings_df
-        no_warning_columns = []
+        #Set extra no_warning_columns (common to both modes)
+        extra_columns = extra_no_warning_cols if isinstance(extra_no_warning_cols, list) else []
         
         #Define headers used and no_warnings_column depending on mode
+        ##Extra columns are added to headers to be used and to no_warning_columns if they are not already present (keeping order)
         if program_mode == 'ENA':
-            ##Set variables
-            headers_used = DEFAULT_ENA_NO_WARNING_COLUMNS + ENA_FASTQ_URLS_COLUMNS
-            no_warning_columns = DEFAULT_ENA_NO_WARNING_COLUMNS
-            ##If extra_no_warning_cols parameters are given add to headers to be used if they are not already present
-            ## And also add to final no_warning_columns list
-            if type(extra_no_warning_cols) == list:
-                headers_used = list(set(DEFAULT_ENA_NO_WARNING_COLUMNS + ENA_FASTQ_URLS_COLUMNS + extra_no_warning_cols))
-                no_warning_columns = list(set(DEFAULT_ENA_NO_WARNING_COLUMNS + extra_no_warning_cols))
+            headers_used = list(dict.fromkeys(DEFAULT_ENA_NO_WARNING_COLUMNS + ENA_FASTQ_URLS_COLUMNS + extra_columns))
+            no_warning_columns = list(dict.fromkeys(DEFAULT_ENA_NO_WARNING_COLUMNS + extra_columns))
         else:
-            if type(extra_no_warning_cols) == list:
-                no_warning_columns = extra_no_warning_cols
+            no_warning_columns = extra_columns
         
         #Global Check (common to both modes)
         ##Check that provided output directory exist
@@ -879,15 +1136,15 @@ def main():
         ##Show loading file message
         print(rich_text_colored('Treatment Template file:', 'general_text', plain_text_bool))
         print(treatment_file_path)
-        ##Load metadata file as pandas df
-        treatment_table = pd.read_csv(treatment_file_path, sep='\t')
+        ##Load treatment file as pandas df
+        treatment_table = load_treatment_template(treatment_file_path)
         
         #Try to load Metadata Table as pandas dataframe
         ##Show loading file message
         print(rich_text_colored('\nMetadata Table file:', 'general_text', plain_text_bool))
         print(metadata_table_path)
-        ##Load metadata file as pandas df
-        metadata = pd.read_csv(metadata_table_path, sep='\t')
+        ##Load metadata file headers as pandas df (the table is loaded after the metadata checks)
+        metadata = pd.read_csv(metadata_table_path, sep = '\t', nrows = 0)
         
         #2)Checks related to the metadata file depending on mode
         if program_mode == 'ENA':
@@ -900,36 +1157,46 @@ def main():
             ##Check generic_common_col_mt in metadata table
             check_generic_column_in_metadata(generic_common_col_mt, metadata, 'generic_common_column_mt')
         
+        ##Load metadata file as pandas df
+        ##NOTE: ENA_COLUMNS_IGNORED columns are not loaded in ENA mode, except the needed headers
+        ##NOTE: the set of skipped columns is built once, so the usecols callable is a single hash lookup per column
+        if program_mode == 'ENA':
+            ena_skipped_columns = frozenset(ENA_COLUMNS_IGNORED).difference(headers_used)
+            metadata = load_metadata_table(metadata_table_path, lambda col: col not in ena_skipped_columns)
+        else:
+            metadata = load_metadata_table(metadata_table_path)
+        
         #3)Checks related to the treatment file(common to both modes)
         
+        ##Compute all Treatment Template checks at once
+        treatment_checks = get_treatment_template_checks(treatment_table)
+        
         ##Check headers in file and messages
-        check_headers_treatmentfile = check_headers(TEMPLATE_FINAL_COLUMNS, treatment_table)
         frase0_1 = 'Error! Some of the needed headers are not in the Treatment Template!\n Check your treatment file!\n'
         frase1_1 = '\nThe headers needed are:'
-        treat_headers_check(TEMPLATE_FINAL_COLUMNS, check_headers_treatmentfile, treatment_table, frase0_1, frase1_1, plain_text_bool)
+        treat_headers_check(TEMPLATE_FINAL_COLUMNS, treatment_checks['headers'], treatment_table, frase0_1, frase1_1, plain_text_bool)
         
         ##Check that values in "fastq_type" column from Treatment Template are valid and treatment
-        check_expected_fastq_type_values = check_values(VALID_FASTQ_TYPES, treatment_table['fastq_type'])
         frase0_2 = 'Error! Some of the values of the "fastq_type" column in the Treatment Template are not valid!\n Check your treatment file!\n'
         frase1_2 = '\nValid values are:'
-        treat_values_check(VALID_FASTQ_TYPES, check_expected_fastq_type_values, frase0_2, frase1_2, plain_text_bool)
+        treat_values_check(VALID_FASTQ_TYPES, treatment_checks['fastq_type'], frase0_2, frase1_2, plain_text_bool)
         
         ##Check that values in "treatment" column from Treatment Template are valid and treatment
-        check_expected_treatment_values = check_values(VALID_TREATMENTS, treatment_table['treatment'])
         frase0_3 = 'Error! Some of the values of the "treatment" column in the Treatment Template are not valid!\n Check your treatment file!\n'
         frase1_3 = '\nValid values are:'
-        treat_values_check(VALID_TREATMENTS, check_expected_treatment_values, frase0_3, frase1_3, plain_text_bool)
+        treat_values_check(VALID_TREATMENTS, treatment_checks['treatment'], frase0_3, frase1_3, plain_text_bool)
         
         ##Check that there are no NA values in "sample_name" column from Treatment Template
-        frase4 = 'Error! Some of the values of the "sample_name" column in the Treatment Template are NAs!\n Check your treatment file!'
-        check_na_in_pandas_dataframe(treatment_table['sample_name'], frase4)
+        if treatment_checks['na_sample_name']:
+            raise OMD_CTK_Exception('Error! Some of the values of the "sample_name" column in the Treatment Template are NAs!\n Check your treatment file!')
         
         ##Check that there are no NA values in "fastq_file_name" column from Treatment Template
-        frase5 = 'Error! Some of the values of the "fastq_file_name" column in the Treatment Template are NAs!\n Check your treatment file!'
-        check_na_in_pandas_dataframe(treatment_table['fastq_file_name'], frase5)
+        if treatment_checks['na_fastq_file_name']:
+            raise OMD_CTK_Exception('Error! Some of the values of the "fastq_file_name" column in the Treatment Template are NAs!\n Check your treatment file!')
         
-        ##Check that there are not duplicate names in "fastq_file_name" column
-        check_duplicates_in_fastq_names(treatment_table, 5)
+        ##Check that there are not duplicate names in "fastq_file_name" column (only builds the message if needed)
+        if treatment_checks['duplicated_fastq_file_name']:
+            check_duplicates_in_fastq_names(treatment_table, 5)
         
         #4)Check that all files in Treatment Template have matching file names and fastq types (common to both modes)
         treat_check_fastq_name_type(treatment_table, fastq_pattern, r1_files_pattern, r2_files_pattern, 5)
@@ -949,9 +1216,10 @@ def main():
                     
         #6)Checks per sample (common to both modes)
         
-        ##Get unique sample names and sort
-        unique_sample_names = list(set(treatment_table['sample_name']))
-        unique_sample_names.sort()
+        ##Convert "sample_name", "treatment" and "fastq_type" to categorical (sample filters and groupbys work on integer codes)
+        treatment_table[TREATMENT_CATEGORICAL_COLUMNS] = treatment_table[TREATMENT_CATEGORICAL_COLUMNS].astype('category')
+        ##Get unique sample names (categories are already sorted)
+        unique_sample_names = treatment_table['sample_name'].cat.categories.tolist()
         
         ##Check mixed treatments per sample
         check_treatment_for_samples(treatment_table, unique_sample_names, 5)
@@ -979,14 +1247,14 @@ def main():
         ##Different mode treatments
         if program_mode == 'ENA':
             ##Get list of colnames of interest in metadata table
-            interest_metadata_columns = [i for i in list(metadata.columns) if i not in ENA_COLUMNS_IGNORED]
+            interest_metadata_columns = metadata.columns.difference(ENA_COLUMNS_IGNORED, sort = False).tolist()
             ##Treat metadata
-            treat_ENA_metadata(treatment_table, unique_sample_names, metadata, ena_download_column, interest_metadata_columns, no_warning_columns, fastq_pattern, sample_name_separator, sep_appearance)
+            treated_metadata_df, warnings_df = treat_ENA_metadata(treatment_table, metadata, ena_download_column, interest_metadata_columns, no_warning_columns, fastq_pattern, sample_name_separator, sep_appearance)
         else:
             ##Get list of colnames of interest in metadata table
-            interest_metadata_columns = list(metadata.columns)
+            interest_metadata_columns = metadata.columns.tolist()
             ##Treat metadata
-            treat_generic_metadata(treatment_table, unique_sample_names, metadata, generic_common_col_mt, generic_common_col_tt, interest_metadata_columns, no_warning_columns, fastq_pattern, sample_name_separator, sep_appearance)
+            treated_metadata_df, warnings_df = treat_generic_metadata(treatment_table, metadata, generic_common_col_mt, generic_common_col_tt, interest_metadata_columns, no_warning_columns, fastq_pattern, sample_name_separator, sep_appearance)
         
         #C)Show main information post-treatment
         ##Print information Title
@@ -997,48 +1265,29 @@ def main():
         ##8)Save generated treated_metadata_df (common to both modes)
         
         #Previous steps
+        ##Get metadata file name (also used for the warning report)
+        metadata_file_name = os.path.basename(metadata_table_path)
         ##Get outfile name
-        outfile_name = 'treated_' + metadata_table_path.split('/')[-1]
+        outfile_name = get_output_file_name('treated_' + metadata_file_name, output_format)
         ##Treat output_directory parameter / Get full output file path
-        outputfile_path = treat_output_directory_parameter_outfiles(outfile_name, outputdir_path)
-        
-        #Show saved file message
-        print(rich_text_colored('\nSaving results in file:', 'general_text', plain_text_bool))
-        print(outputfile_path)
+        outputfile_path = treat_output_directory_parameter_outfiles(outfile_name, outputdir_path, '.' + output_format)
         
-        #Save template
-        treated_metadata_df.to_csv(outputfile_path, header = True, index = False, sep = '\t')
+        #Save treated metadata (showing saved file message)
+        save_output_table(treated_metadata_df, outputfile_path, output_format, 'results', plain_text_bool)
         
         #9)Treat warnings
-        if len(warnings_df) > 0:
+        if not warnings_df.empty:
             #Previous steps
             ##Get outfile name
-            outreport_name = 'warning_report_4_treated_' + metadata_table_path.split('/')[-1]
+            outreport_name = get_output_file_name('warning_report_4_treated_' + metadata_file_name, output_format)
             ##Treat output_directory parameter / Get full output file path
-            outreport_path = treat_output_directory_parameter_outfiles(outreport_name, outputdir_path)
+            outreport_path = treat_output_directory_parameter_outfiles(outreport_name, outputdir_path, '.' + output_format)
             
             #Show warning message
-            print(rich_text_colored('\nSome of the samples showed warnings when trying to treat their metadata!', 'program_warning', plain_text_bool))
-            print(rich_text_colored('\nThis could be due to:','due_to_header', plain_text_bool))
-            print('- The presence of quality controlled Fastqs in the dataset', rich_text_colored('[Acceptable]', 'acceptable', plain_text_bool))
-            print('- Multiple sequencer output Fastqs (runs/lanes) from the same sample', rich_text_colored('[Warning]', 'legend_warning', plain_text_bool))
-            print('- Technical replicates from the same sample', rich_text_colored('[Warning]', 'legend_warning', plain_text_bool))
-            print('- PAIRED files uploaded as SINGLE Fastq files', rich_text_colored('[Warning]', 'legend_warning', plain_text_bool))
-            print('- The presence of different sequencing technologies', rich_text_colored('[Dangerous]', 'dangerous', plain_text_bool))
-            print('- The presence of different data types in the dataset', rich_text_colored('[Dangerous]', 'dangerous', plain_text_bool))
-            print("- Authors' mishandle, upload errors or others", rich_text_colored('[Dangerous]', 'dangerous', plain_text_bool))
-            print(rich_text_colored('\nYou should:', 'you_should_header', plain_text_bool))
-            print('- Use the following warning report to manually confirm which is your case')
-            print('- Check if in your particular case these metadata combination merges with several values are acceptable or not')
-            print('- If necessary, search for extra information in the original database (If the dataset was not originally uploaded to ENA, try at Sequence Read Archive, or DNA Data Bank of Japan)')
-            print('- Check the original publication and supplementary tables to get some context')
-            
-            #Show saved file message
-            print(rich_text_colored('\nSaving report in file:', 'general_text', plain_text_bool))
-            print(outreport_path)
+            show_treatment_warnings_message(plain_text_bool)
             
-            #Save template
-            warnings_df.to_csv(outreport_path, header = True, index = False, sep = '\t')
+            #Save warning report (showing saved file message)
+            save_output_table(warnings_df, outreport_path, output_format, 'report', plain_text_bool)
             
             #Show advise legend
             show_advise_legend(plain_text_bool)